@@ -1,9 +1,11 @@
 use argon2::{Algorithm, Argon2, Params, Version};
+use base64::prelude::{Engine, BASE64_STANDARD};
 use ed25519_dalek::{SecretKey, SigningKey, PUBLIC_KEY_LENGTH};
 use rand::rngs::ThreadRng;
 //use rand::seq::IteratorRandom;
 use rand::Rng;
-use serde::Deserialize;
+use serde::de::Error;
+use serde::{Deserialize, Deserializer};
 use std::collections::HashMap;
 use std::env;
 use std::fs::{File, OpenOptions};
@@ -62,12 +64,35 @@ fn derive_key(root_key: &[u8], identifier: &[u8]) -> [u8; 32] {
     new_key
 }
 
+/// A 32 byte key as stored in the global secrets file.
+#[derive(Deserialize)]
+#[serde(untagged)]
+enum EncodedKey {
+    Base64(String),
+    /// Older secrets files stored keys as a list of byte values
+    Bytes([u8; 32]),
+}
+
+/// Deserialize a base64 encoded 32 byte key from the global secrets file.
+fn deserialize_key<'de, D: Deserializer<'de>>(deserializer: D) -> Result<[u8; 32], D::Error> {
+    let encoded = match EncodedKey::deserialize(deserializer)? {
+        EncodedKey::Base64(encoded) => encoded,
+        EncodedKey::Bytes(key) => return Ok(key),
+    };
+    let key = BASE64_STANDARD.decode(encoded).map_err(D::Error::custom)?;
+
+    key.try_into()
+        .map_err(|_| D::Error::custom("key in global secrets is not 32 bytes"))
+}
+
 /// Secrets keys in global secrets file.
 ///
 /// See python secret generation for details.
 #[derive(Debug, Deserialize)]
 struct GlobalSecrets {
+    #[serde(deserialize_with = "deserialize_key")]
     subscribe_root_key: [u8; 32],
+    #[serde(deserialize_with = "deserialize_key")]
     subscribe_private_key: [u8; 32],
     channels: HashMap<usize, ChannelSecrets>,
 }
@@ -77,7 +102,9 @@ struct GlobalSecrets {
 /// See python secret generation for details.
 #[derive(Debug, Deserialize)]
 struct ChannelSecrets {
+    #[serde(deserialize_with = "deserialize_key")]
     root_key: [u8; 32],
+    #[serde(deserialize_with = "deserialize_key")]
     private_key: [u8; 32],
 }
 
@@ -65,7 +65,7 @@ def gen_subscription(
     # if length < 256, it can be packed into a byte
     # 126 should be the worst case
     assert len(key_nodes) <= 126
-    logger.debug(f"Generated {len(key_nodes)} nodes")
+    logger.debug("Generated {} nodes", len(key_nodes))
     assert all(len(node.key) == 32 for node in key_nodes)
 
     # since nodes are continuous and sorted by range,
@@ -77,8 +77,8 @@ def gen_subscription(
         + b"".join([node.key for node in key_nodes])
     )
 
-    logger.debug(f"Total length = {len(data)}")
-    logger.debug(f"Data before encryption: {data}")
+    logger.debug("Total length = {}", len(data))
+    logger.debug("Data before encryption: {}", data)
     return encrypt_payload(
         data,
         struct.pack("<I", device_id),
@@ -142,7 +142,7 @@ def main():
     #
     # NOTE: Printing sensitive data is generally not good security practice
     logger.debug(
-        f"Generated subscription for {args.start}..={args.end}: {subscription}"
+        "Generated subscription for {}..={}: {}", args.start, args.end, subscription
     )
 
     # Open the file, erroring if the file exists unless the --force arg is provided
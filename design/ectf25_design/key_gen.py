@@ -1,69 +1,58 @@
 from dataclasses import dataclass
-from typing import Self
 
-from .util import compute_chacha_block, verify_timestamp
+from .util import compute_chacha_blocks, derive_chain, verify_timestamp
 
 
-@dataclass
+@dataclass(slots=True)
 class KeyNode:
     key: bytes
     lowest_timestamp: int
     highest_timestamp: int
-    left: Self | None = None
-    right: Self | None = None
-
-    def gen_left_node(self):
-        leftcha = compute_chacha_block(self.key)[: len(self.key)]
-        new_highest = (self.lowest_timestamp + self.highest_timestamp) // 2
-        self.left = KeyNode(leftcha, self.lowest_timestamp, new_highest)
-        return self.left
-
-    def gen_right_node(self):
-        rightcha = compute_chacha_block(self.key)[len(self.key) :]
-        new_lowest = (self.lowest_timestamp + self.highest_timestamp + 1) // 2
-        self.right = KeyNode(rightcha, new_lowest, self.highest_timestamp)
-        return self.right
 
     def depth(self):
         return 64 - (self.highest_timestamp - self.lowest_timestamp).bit_count()
 
 
-def generate_tree(
-    node: KeyNode,
-    min_time: int,
-    max_time: int,
-    left_start: int = 0,  # the lowest timestamp that this node can provide
-    right_end: int = 2**64 - 1,  # the highest timestamp that this node can provide
-):
-    """
-    Recursively calculate the smallest set of nodes to represent a time range.
-    Stores the possible time range for the current node instead of using the timestamp.
+def generate_tree(root_key: bytes, min_time: int, max_time: int) -> list[KeyNode]:
     """
+    Calculate the smallest set of nodes to represent a time range.
 
-    # if there is only 1 node in the range, early return
-    if left_start == right_end:
-        assert min_time <= left_start <= max_time
-        return [node]
-
-    # split the range at the middle
-    right_start = (left_start + right_end + 1) // 2
-    left_end = right_start - 1
-
-    left_side = (left_start, left_end, node.gen_left_node())
-    right_side = (right_start, right_end, node.gen_right_node())
+    Nodes are tracked by their path from the root, with the bits of the path being
+    the directions taken (0 = left, 1 = right), so the walk itself is only integer
+    math on the two bounds. The tree is walked one level at a time so the chacha
+    blocks of every node still being split at that level are computed in a single batch.
+    """
 
     nodes_arr = []
-    for start, end, new_node in (left_side, right_side):
-        # if there is any overlap between the two ranges, there's some nodes to check
-        if start <= max_time and min_time <= end:
-            # if this node's range is fully inside the target range, just add this node.
-            if min_time <= start and end <= max_time:
-                nodes_arr.append(new_node)
-            # otherwise, recursively look for the correct nodes
-            else:
-                nodes_arr.extend(
-                    generate_tree(new_node, min_time, max_time, start, end),
-                )
+
+    # path and key of the nodes on the current level which only partially overlap the target range
+    frontier = [(0, root_key)]
+    for depth in range(1, 65):
+        blocks = compute_chacha_blocks([key for _, key in frontier])
+
+        # a node at this depth spans 2**shift timestamps
+        shift = 64 - depth
+
+        next_frontier = []
+        for (parent_path, _), block in zip(frontier, blocks):
+            for direction in (0, 1):
+                path = (parent_path << 1) | direction
+                start = path << shift
+                end = start + (1 << shift) - 1
+
+                # if there is any overlap between the two ranges, there's some nodes to check
+                if start <= max_time and min_time <= end:
+                    key = block[direction * 32 : (direction + 1) * 32]
+                    # if this node's range is fully inside the target range, just add this node.
+                    if min_time <= start and end <= max_time:
+                        nodes_arr.append(KeyNode(key, start, end))
+                    # otherwise, look for the correct nodes on the next level
+                    else:
+                        next_frontier.append((path, key))
+
+        if not next_frontier:
+            break
+        frontier = next_frontier
     return nodes_arr
 
 
@@ -82,6 +71,11 @@ def generate_subscription_nodes(
     verify_timestamp(max_time)
     assert min_time <= max_time
 
-    root_node = KeyNode(root_key, 0, 2**64 - 1)
+    # if the range is exactly one subtree (including the whole tree), that node is the
+    # only one needed, and it can be derived directly without walking the tree
+    size = max_time - min_time + 1
+    if size.bit_count() == 1 and min_time % size == 0:
+        depth = 64 - (size.bit_length() - 1)
+        return [KeyNode(derive_chain(root_key, min_time, depth), min_time, max_time)]
 
-    return generate_tree(root_node, min_time, max_time)
+    return generate_tree(root_key, min_time, max_time)
@@ -1,31 +1,142 @@
 import base64
+import ctypes
+import ctypes.util
 import json
 import struct
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict, List, Self
 
-from argon2 import PasswordHasher
+from argon2.low_level import Type, hash_secret_raw
 from Crypto.Cipher import ChaCha20, ChaCha20_Poly1305
 from Crypto.Random import get_random_bytes
 from Crypto.Signature import eddsa
 
+# orjson is optional, it is only used to read and write the secrets file faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _load_sodium() -> ctypes.CDLL | None:
+    """Loads libsodium if it is installed, it is only used to speed up crypto."""
+
+    path = ctypes.util.find_library("sodium")
+    if path is None:
+        return None
+
+    try:
+        sodium = ctypes.CDLL(path)
+    except OSError:
+        return None
+
+    # older libsodium builds lack some of these, e.g. xchacha20poly1305 before 1.0.12
+    try:
+        # picks the fastest chacha implementation for this cpu
+        if sodium.sodium_init() < 0:
+            return None
+
+        sodium.crypto_stream_chacha20.argtypes = [
+            ctypes.c_char_p,
+            ctypes.c_ulonglong,
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+        ]
+        sodium.crypto_stream_chacha20.restype = ctypes.c_int
+
+        sodium.crypto_aead_xchacha20poly1305_ietf_encrypt_detached.argtypes = [
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+            ctypes.c_void_p,
+            ctypes.c_char_p,
+            ctypes.c_ulonglong,
+            ctypes.c_char_p,
+            ctypes.c_ulonglong,
+            ctypes.c_void_p,
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+        ]
+        sodium.crypto_aead_xchacha20poly1305_ietf_encrypt_detached.restype = (
+            ctypes.c_int
+        )
+
+        sodium.crypto_sign_seed_keypair.argtypes = [
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+        ]
+        sodium.crypto_sign_seed_keypair.restype = ctypes.c_int
+
+        sodium.crypto_sign_detached.argtypes = [
+            ctypes.c_char_p,
+            ctypes.c_void_p,
+            ctypes.c_char_p,
+            ctypes.c_ulonglong,
+            ctypes.c_char_p,
+        ]
+        sodium.crypto_sign_detached.restype = ctypes.c_int
+    except AttributeError:
+        return None
+
+    return sodium
+
+
+_SODIUM = _load_sodium()
+
+# key tree chacha blocks use the original chacha20 with an all zero 8 byte nonce,
+# and the keystream is taken by encrypting an all zero block
+_ZERO_NONCE = bytes(8)
+_ZERO_BLOCK = bytes(64)
+
+
 def random(n: int) -> bytes:
     """Generates `n` cryptographically secure random bytes."""
 
     return get_random_bytes(n)
 
 
-def bytes_to_eddsa_key(key: bytes) -> eddsa.EdDSASigScheme:
+class SodiumSigScheme:
+    """Ed25519 signing key backed by libsodium.
+
+    Produces the same pure Ed25519 signatures as `eddsa.EdDSASigScheme`,
+    but signing takes a fraction of the time.
+    """
+
+    __slots__ = ("_secret_key", "public_key")
+
+    def __init__(self, private_key: bytes):
+        assert len(private_key) == 32
+
+        public_key = ctypes.create_string_buffer(32)
+        secret_key = ctypes.create_string_buffer(64)
+        _SODIUM.crypto_sign_seed_keypair(public_key, secret_key, private_key)
+        self._secret_key = secret_key.raw
+        self.public_key = public_key.raw
+
+    def sign(self, message: bytes) -> bytes:
+        signature = ctypes.create_string_buffer(64)
+        _SODIUM.crypto_sign_detached(
+            signature, None, message, len(message), self._secret_key
+        )
+        return signature.raw
+
+
+SigScheme = eddsa.EdDSASigScheme | SodiumSigScheme
+
+
+def bytes_to_eddsa_key(key: bytes) -> SigScheme:
     """Constructs an Ed25519 signing key for a private key of bytes."""
 
+    if _SODIUM is not None:
+        return SodiumSigScheme(key)
+
     return eddsa.new(eddsa.import_private_key(key), "rfc8032")
 
 
 def verify_timestamp(timestamp: int):
     """Asserts the given integer is a valid timestamp."""
 
-    assert timestamp >= 0
-    assert timestamp < (2**64)
+    assert 0 <= timestamp < (1 << 64)
 
 
 def verify_decoder(decoder_id: int):
@@ -35,26 +146,41 @@ def verify_decoder(decoder_id: int):
     assert decoder_id < (2**32)
 
 
+def encode_key(key: bytes) -> str:
+    """Encodes a key as base64 for storing in the secrets file."""
+
+    return base64.b64encode(key).decode("ascii")
+
+
+def decode_key(encoded: str | list[int]) -> bytes:
+    """Decodes a base64 key from the secrets file."""
+
+    # older secrets files stored keys as a list of byte values
+    if isinstance(encoded, list):
+        return bytes(encoded)
+
+    return base64.b64decode(encoded, validate=True)
+
+
 def derive_key(root_key: bytes, identifier: bytes) -> bytes:
     """Derives a 32 byte key from a root key and a unique identifier."""
 
     # use argon2id to derive key from root key
-    # these are the default values, just explicitly specified, and with different salt len
-    hasher = PasswordHasher(
+    # these are the defaults of argon2-cffi's PasswordHasher, just explicitly specified,
+    # and must match the parameters used by the decoder build script.
+    # The raw api returns the hash bytes directly, instead of a base64 encoded string
+    # with all the parameters in it.
+    return hash_secret_raw(
+        secret=identifier,
+        salt=root_key,
         time_cost=3,
         memory_cost=65536,
         parallelism=4,
         hash_len=32,
-        salt_len=32,
+        type=Type.ID,
     )
-    decoder_id_hash = hasher.hash(identifier, salt=root_key)
-
-    # returned hash string has many paramaters encoded as well, delimeted by $
-    # last element is the hash itself
-    # have to add 1 = to base64 because python base64 padding is always mandatory apparently
-    return base64.b64decode(decoder_id_hash.split("$")[-1] + "=")
 
-@dataclass
+@dataclass(slots=True)
 class ChannelKey:
     """Keys used for a specific channel."""
 
@@ -65,14 +191,33 @@ class ChannelKey:
     # Ed25519 private key used to sign tv frames.
     private_key: bytes
 
-    def signing_key(self) -> eddsa.EdDSASigScheme:
-        return bytes_to_eddsa_key(self.private_key)
+    # signing key constructed from `private_key`, built the first time it is needed
+    _signer: SigScheme | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    # raw public key of `private_key`, computed the first time it is needed
+    _public_key: bytes | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def signing_key(self) -> SigScheme:
+        if self._signer is None:
+            self._signer = bytes_to_eddsa_key(self.private_key)
+        return self._signer
 
     def public_key_bytes(self) -> bytes:
-        pub_key = eddsa.import_private_key(self.private_key).public_key()
-        raw = pub_key.export_key(format="raw")
-        assert len(raw) == 32
-        return raw
+        if self._public_key is None:
+            signer = self.signing_key()
+            if isinstance(signer, SodiumSigScheme):
+                # libsodium already computed it when building the signer
+                raw = signer.public_key
+            else:
+                pub_key = eddsa.import_private_key(self.private_key).public_key()
+                raw = pub_key.export_key(format="raw")
+            assert len(raw) == 32
+            self._public_key = raw
+        return self._public_key
 
     @classmethod
     def generate(cls) -> Self:
@@ -82,7 +227,7 @@ class ChannelKey:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class GlobalSecrets:
     """All global secrets for the satelite tv system."""
 
@@ -94,7 +239,7 @@ class GlobalSecrets:
 
     channels: dict[int, ChannelKey]
 
-    def subscription_signing_key_for_decoder(self, decoder_id: int) -> eddsa.EdDSASigScheme:
+    def subscription_signing_key_for_decoder(self, decoder_id: int) -> SigScheme:
         # decoder id must be 4 byte unsigned integer
         verify_decoder(decoder_id)
         decoder_id_bytes = struct.pack("<I", decoder_id)
@@ -128,29 +273,35 @@ class GlobalSecrets:
         )
 
     def to_json(self) -> str:
-        return json.dumps({
-            "subscribe_root_key": list(self.subscribe_root_key),
-            "subscribe_private_key": list(self.subscribe_private_key),
+        secrets = {
+            "subscribe_root_key": encode_key(self.subscribe_root_key),
+            "subscribe_private_key": encode_key(self.subscribe_private_key),
             "channels": {
                 channel_id: {
-                    "root_key": list(channel.root_key),
-                    "private_key": list(channel.private_key),
+                    "root_key": encode_key(channel.root_key),
+                    "private_key": encode_key(channel.private_key),
                 }
                 for channel_id, channel in self.channels.items()
             },
-        })
+        }
+
+        if orjson is not None:
+            return orjson.dumps(secrets, option=orjson.OPT_NON_STR_KEYS).decode()
+        return json.dumps(secrets)
 
     @classmethod
     def from_json(cls, raw_data: str) -> Self:
-        data: dict = json.loads(raw_data)
+        data: dict = (
+            orjson.loads(raw_data) if orjson is not None else json.loads(raw_data)
+        )
 
         return cls(
-            subscribe_root_key=bytes(data["subscribe_root_key"]),
-            subscribe_private_key=bytes(data["subscribe_private_key"]),
+            subscribe_root_key=decode_key(data["subscribe_root_key"]),
+            subscribe_private_key=decode_key(data["subscribe_private_key"]),
             channels={
                 int(channel_id): ChannelKey(
-                    root_key=bytes(channel_json["root_key"]),
-                    private_key=bytes(channel_json["private_key"]),
+                    root_key=decode_key(channel_json["root_key"]),
+                    private_key=decode_key(channel_json["private_key"]),
                 )
                 for channel_id, channel_json in data["channels"].items()
             },
@@ -161,7 +312,7 @@ def encrypt_payload(
     data: bytes,
     associated_data: bytes,
     symmetric_key: bytes,
-    private_key: eddsa.EdDSASigScheme,
+    private_key: SigScheme,
 ):
     """
     This function encrypts and signs all sensitive payloads sent to the decoder,
@@ -185,15 +336,14 @@ def encrypt_payload(
     """
 
     nonce = random(24)
-    cipher = ChaCha20_Poly1305.new(key=symmetric_key, nonce=nonce)
-    # associated data must be fed in before encrypting
-    cipher.update(associated_data)
-    (ciphertext, poly1305_tag) = cipher.encrypt_and_digest(data)
+    (ciphertext, poly1305_tag) = xchacha20poly1305_seal(
+        symmetric_key, nonce, associated_data, data
+    )
 
     # now sign the payload
     # must sign nonce and tag too to prevent attacker with leaked
     # key from changing nonce to get different decryption
-    payload_to_sign = nonce + poly1305_tag + ciphertext + associated_data
+    payload_to_sign = b"".join((nonce, poly1305_tag, ciphertext, associated_data))
 
     # we are using eddsa in 'pure' mode (no hashing before signing, only using the 2 hashes in eddsa itself)
     signature = private_key.sign(payload_to_sign)
@@ -201,12 +351,99 @@ def encrypt_payload(
     return signature + payload_to_sign
 
 
+def xchacha20poly1305_seal(
+    key: bytes,
+    nonce: bytes,
+    associated_data: bytes,
+    data: bytes,
+) -> tuple[bytes, bytes]:
+    """Encrypts `data` with XChaCha20Poly1305, returning the ciphertext and tag."""
+
+    assert len(key) == 32
+    assert len(nonce) == 24
+
+    if _SODIUM is not None:
+        ciphertext = ctypes.create_string_buffer(len(data))
+        poly1305_tag = ctypes.create_string_buffer(16)
+        _SODIUM.crypto_aead_xchacha20poly1305_ietf_encrypt_detached(
+            ciphertext,
+            poly1305_tag,
+            None,
+            data,
+            len(data),
+            associated_data,
+            len(associated_data),
+            None,
+            nonce,
+            key,
+        )
+        return ciphertext.raw, poly1305_tag.raw
+
+    # pycryptodome picks XChaCha20 from the 24 byte nonce
+    cipher = ChaCha20_Poly1305.new(key=key, nonce=nonce)
+    # associated data must be fed in before encrypting
+    cipher.update(associated_data)
+    return cipher.encrypt_and_digest(data)
+
+
 def compute_chacha_block(data: bytes) -> bytes:
     """Computes 1 length doubling chacha block."""
 
     assert len(data) == 32
 
-    cipher = ChaCha20.new(key=data, nonce=b"\0" * 8)
+    if _SODIUM is not None:
+        # libsodium's crypto_stream_chacha20 is original chacha20 with an 8 byte nonce
+        block = ctypes.create_string_buffer(64)
+        _SODIUM.crypto_stream_chacha20(block, 64, _ZERO_NONCE, data)
+        return block.raw
+
+    cipher = ChaCha20.new(key=data, nonce=_ZERO_NONCE)
 
     # just encrypt 0s to get the keystream
-    return cipher.encrypt(b"\0" * 64)
+    return cipher.encrypt(_ZERO_BLOCK)
+
+
+def compute_chacha_blocks(keys: list[bytes]) -> list[bytes]:
+    """Computes 1 length doubling chacha block for each key.
+
+    Used to derive a whole level of the key tree at once.
+    """
+
+    if _SODIUM is None:
+        return [compute_chacha_block(key) for key in keys]
+
+    # one buffer is reused for the whole batch
+    block = ctypes.create_string_buffer(64)
+    blocks = []
+    for key in keys:
+        assert len(key) == 32
+        _SODIUM.crypto_stream_chacha20(block, 64, _ZERO_NONCE, key)
+        blocks.append(block.raw)
+    return blocks
+
+
+def derive_chain(root_key: bytes, time: int, depth: int = 64) -> bytes:
+    """
+    Derives the key of the node `depth` levels below `root_key` on the path to `time`.
+
+    Each bit of `time` from highest-order to lowest-order picks the left (0)
+    or right (1) half of the chacha block of the current key.
+    """
+
+    if _SODIUM is None:
+        key = root_key
+        for level in range(depth):
+            offset = ((time >> (63 - level)) & 1) * 32
+            key = compute_chacha_block(key)[offset : offset + 32]
+        return key
+
+    assert len(root_key) == 32
+
+    # one buffer is reused for the whole chain
+    key = root_key
+    block = ctypes.create_string_buffer(64)
+    for level in range(depth):
+        _SODIUM.crypto_stream_chacha20(block, 64, _ZERO_NONCE, key)
+        offset = ((time >> (63 - level)) & 1) * 32
+        key = block.raw[offset : offset + 32]
+    return key
@@ -10,21 +10,18 @@ if __name__ == "__main__":
 
     conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     conn.connect((os.environ["IP"], int(os.environ["PORT"])))
-    conn.send(f"{os.environ['TOKEN']}|build-ours".encode())
+    conn.sendall(f"{os.environ['TOKEN']}|build-ours".encode())
     ack = conn.recv(1024).decode()
 
     if not ack or "Invalid" in ack:
         print("Connection error")
         sys.exit(1)
 
-    conn.send(f"{sys.argv[1]}|{sys.argv[2]}|{sys.argv[3]}|{sys.argv[4]}".encode())
+    conn.sendall(f"{sys.argv[1]}|{sys.argv[2]}|{sys.argv[3]}|{sys.argv[4]}".encode())
 
-    while True:
-        data = conn.recv(1024)
-        if not data:
-            break
-        line = data.decode(errors="ignore")
-        if "%*&" in line:
-            print(line[:(line.find("%*&"))])
-            sys.exit(int(line[(line.find("%*&") + 3):].split("\n")[0]))
-        print(line, end = "")
+    for line in conn.makefile("rb"):
+        if b"%*&" in line:
+            output, _, code = line.decode(errors="ignore").partition("%*&")
+            print(output)
+            sys.exit(int(code.split("\n")[0]))
+        print(line.decode(errors="ignore"), end = "")